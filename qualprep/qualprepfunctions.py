@@ -4,7 +4,6 @@ import pandas as pd
 import numpy as np 
 from tqdm import tqdm
 import ast
-import math
 
 # Splitting a categorical variable
 def split_categorical_vars(series, values_and_labels): 
@@ -15,7 +14,7 @@ def split_categorical_vars(series, values_and_labels):
     Parameters
     ----------- 
         data: pd series
-            Series made up of lists
+            Series made up of lists (strings such as "1,3") or single whole numbers
             
         variable_name: str
             Name of the variable
@@ -28,40 +27,36 @@ def split_categorical_vars(series, values_and_labels):
     -------
         pd df
         Splitted variable as df. Column names are values of values_and_labels. Entires are 0 and 1 with
-        1 indicating that the repective category was in the list and 0 otherwise. 
+        1 indicating that the repective category was in the list and 0 otherwise (stored as int8). 
+        The index of series is kept. 
     '''
     
-    series = series.copy()
+    categories = pd.Index(list(values_and_labels.keys()))
     
-    output = []
+    # Single numeric responses (e.g., read from Excel with empty cells) must be whole numbers. They are 
+    # turned into integers so that 1.0 is matched as "1". 
+    if series.dtype.kind == "f": 
+        if not ((series.dropna() % 1) == 0).all(): 
+            raise TypeError("Series " + str(series.name) + " contains numbers that are not whole numbers. " + 
+                            "Responses need to be strings or whole numbers.")
+        series = series.astype("Int64").astype("string")
+    elif series.dtype.kind not in ("O", "i", "u"): 
+        raise TypeError("Series " + str(series.name) + " has type " + str(series.dtype) + ". " + 
+                        "Responses need to be strings or whole numbers.")
     
-    # Go through all responses
-    for ind, val in series.items(): 
-        
-        # Create an empty np array to add categories
-        add = np.full(len(values_and_labels), 0)
-        
-        # Check if the value is empty (no category)
-        if not is_nan(val): 
-            
-            # Split the object if necessary
-            if response_length(val) > 1: 
-                val = list(val.split(","))
-            else: 
-                val = [str(val)]
-         
-            for key in list(values_and_labels.keys()): 
-
-                # If the value is in the series item (i.e., response), add a 1 at the respective place in the add array. 
-                
-                if key in val: 
-                    add[list(values_and_labels.keys()).index(key)] = 1
-        
-        # Once we checked all keys, add the array to our output
-        output.append(add)
+    # Split all responses into one token per row, indexed by the position of the response
+    tokens = series.reset_index(drop = True).fillna("").astype(str).str.split(",").explode()
+    
+    # Position of each token in the categories (-1 if the token is not a category)
+    cols = categories.get_indexer(tokens)
+    known = cols >= 0
+    
+    # Mark the categories of each response in a single int8 array
+    output = np.zeros((len(series), len(categories)), dtype = np.int8)
+    output[tokens.index[known], cols[known]] = 1
     
     # Turn into pd df
-    output = pd.DataFrame(output, columns = list(values_and_labels.values()))
+    output = pd.DataFrame(output, columns = list(values_and_labels.values()), index = series.index)
     
     return output
 
@@ -88,15 +83,17 @@ def split_multiple_categorical_vars (data, split_info):
         with the splitted version. The names of the new variables correspond to the labels as defined in 
         split_info. The variables are 0 if the respective value was not present and 1 if it was present. 
     '''
-    dat = data.copy()
+    # Rename the split_info columns (without changing the split_info passed in)
+    split_info = split_info.set_axis(["variable_name", "values_and_labels"], axis = 1)
     
-    split_info.columns = ["variable_name", "values_and_labels"]
+    # Split all variables first and combine them with the data in a single concat
+    splits = [split_categorical_vars(data[variable_name], ast.literal_eval(values_and_labels)) 
+              for variable_name, values_and_labels in tqdm(zip(split_info["variable_name"], 
+                                                               split_info["values_and_labels"]), 
+                                                           total = len(split_info))]
     
-    for ind in tqdm(split_info.index): 
-        split_variable = split_categorical_vars(dat[split_info.loc[ind, "variable_name"]], 
-                                          ast.literal_eval(split_info.loc[ind, "values_and_labels"]))
-        dat = dat.drop(columns = split_info.loc[ind, "variable_name"])
-        dat = pd.concat([dat, split_variable], axis = 1)
+    dat = data.drop(columns = list(split_info["variable_name"]))
+    dat = pd.concat([dat] + splits, axis = 1)
         
     return dat
 
@@ -117,56 +114,21 @@ def get_lookup(df):
     Note: The function ignores capitalization. It will retrun the lookup in all
     low caps. 
     '''
-    norm_dict = []
-    df_rawstring_index = df.copy()
-    df_rawstring_index.rename(columns={df_rawstring_index.columns[0]: "rawstring"}, inplace = True)
+    # Number the rows by position, so the lookup keeps the order of the normalization file
+    df = df.reset_index(drop = True)
     
-    # Remove duplicates from the lookup to prevent wrong multiplication
-    df_rawstring_index["rawstring"] = df_rawstring_index["rawstring"].str.lower()
-    df_rawstring_index.drop_duplicates(subset=['rawstring'], inplace = True)
-    
-    df_rawstring_index = df_rawstring_index.set_index("rawstring")
-    for index, row in df_rawstring_index.iterrows():
-        for i in range(0, len(row)):
-            if pd.notnull(row[i]):
-                norm_dict.append([str(index).lower(), row[i]])
-    return pd.DataFrame(norm_dict, columns = ["rawstring", "normalized"])
-
-# Function to replace items under consideration that multiple replacements are possible
-    # Used in the normalize_data function
-def replace(replace_in_object, replacement_string, position):
-    ''' 
-    Function to replace an object in a series with multiplying the object if there are multiple replacements. 
+    # Lower case the rawstring (first column) and keep the normalizations (following columns)
+    lookup = df.iloc[:, 1:].assign(rawstring = df.iloc[:, 0].str.lower())
     
-    Parameters
-    ----------
-        replace_in_object: pd series
-            The object where something has to be replaced (i.e., row of bird sights including 
-        'Vermillion and Ghila', 'Arizona', 'eating and sleeping')
-            
-        replacement_string: list
-            List of instances that serve as replacement (e.g., normalized strings for a raw string
-                                                         such as "Vermillion fly catcher" and "Ghila woodpecker" for "Vermillion and Ghila") 
-        
-        position: int
-            The position in the replace_in_object where the replacement has to take place 
-            (as number, i.e., 0)
-        
-    Returns
-    -------
-    List of objects where the replacement have been done. 
-    '''
+    # Remove duplicates from the lookup to prevent wrong multiplication
+    lookup = lookup.drop_duplicates(subset = ["rawstring"])
     
-    replaced = []
+    # Turn the replacement columns into rows and sort them back by row position
+    lookup = (lookup.melt(id_vars = "rawstring", value_name = "normalized", ignore_index = False)
+              .dropna(subset = ["normalized"])
+              .sort_index(kind = "stable"))
     
-    for replstr in replacement_string: 
-        
-        replace_in_object_copy = replace_in_object.copy()
-        replace_in_object_copy[position] = replstr
-
-        replaced.append(replace_in_object_copy)
-
-    return replaced
+    return lookup[["rawstring", "normalized"]].reset_index(drop = True)
 
 # Function to normalize datas
 def normalize_data(data, lookup, normalization_variable):
@@ -188,34 +150,25 @@ def normalize_data(data, lookup, normalization_variable):
         
     Return: 
         normalized version of data. If an organization raw string contains multiple normalized orgs the
-        respective row is copied. 
+        respective row is copied. Rows without an entry in the lookup keep the original version. 
         
     Note: The function ignores capitalization, it transfers everything into low caps. 
     '''
-    normalized_data = []
-    problem = []
-    
-    
-    # data = data.reset_index()
-    # print(data.index)
-    for ind in tqdm(data.index): 
-        
-        # print(ind)
-        # print(data.loc[ind, normalization_variable])
-        replacement_string = lookup.loc[lookup["rawstring"] == data.loc[ind, normalization_variable].lower()
-        , "normalized"]
-        
-        if len(replacement_string) == 0: 
-            # problem.append([ind, data.loc[ind, normalization_variable]])
-            print("No entry found for " + str(data.loc[ind, normalization_variable]) + " in normalization_info. Keep original version." )
-        else: 
-            normalization_position = data.columns.get_loc(normalization_variable)
-            normalized_row = (replace(data.loc[ind], replacement_string, normalization_position))
-            [normalized_data.append(entry) for entry in normalized_row]
-            # print(normalization_position)
-            # print(normalized_data)
-    
-    normalized_data = pd.DataFrame(normalized_data, columns = data.columns)
+    # Join the lookup on the lower case version of the normalization variable. Rows with multiple 
+    # normalized strings are multiplied by the join. 
+    # Empty or non-string rawstrings are dropped, so missing values in data are not joined to them
+    lookup = (lookup.rename(columns = {"rawstring": "_rawstring", "normalized": "_normalized"})
+              .dropna(subset = ["_rawstring"]))
+    normalized_data = (data.assign(_rawstring = data[normalization_variable].str.lower())
+                       .merge(lookup, on = "_rawstring", how = "left"))
+    
+    # Keep the original version of rows without an entry in the lookup
+    missing = normalized_data["_normalized"].isna()
+    for entry in normalized_data.loc[missing, normalization_variable]: 
+        print("No entry found for " + str(entry) + " in normalization_info. Keep original version." )
+    
+    normalized_data[normalization_variable] = normalized_data["_normalized"].fillna(normalized_data[normalization_variable])
+    normalized_data = normalized_data.drop(columns = ["_rawstring", "_normalized"])
     
     return normalized_data
 
@@ -232,28 +185,33 @@ def repl_with_agg_string(data, column, replacement_string_dict):
         column: str
             Column which contains the normalized strings. 
         
-        replacement_string_dict: dict
+        replacement_string_dict: dict or pd series
             Dictionary containing the normalized strings and the 
             higher-level replacement strings. This needs to be in dictionary format. 
             Normalized string as key, higher-level aggregation version as value. 
             For example: "Acorn woodpecker" and "Ghila woodpecker" are replace with "woodpecker"
             {"Acorn woodpecker": "woodpecker", "Ghila woodpecker": "woodpecker"}
+            A pd series with the normalized strings as index (e.g., pd.Series(replacement_string_dict))
+            can be passed instead. This avoids converting the dictionary in every call. 
         
     Returns
     -------
         pd df    
-        Data with normalized strings replaced by higher-level aggregation strings. 
+        Data with normalized strings replaced by higher-level aggregation strings. Strings without an 
+        entry in replacement_string_dict are kept as they are. 
     '''
     
-    data_updated = data.copy()
-    data_updated = data_updated.reset_index(drop=True)
+    # reset_index returns a new df, so the column can be replaced without changing data
+    data_updated = data.reset_index(drop=True)
     
-    for ind in data_updated.index: 
-        
-        data_updated.loc[ind, column] = replacement_string_dict[data_updated.loc[ind, column]]
+    # Replace all strings at once. Strings that are not in replacement_string_dict are kept. 
+    data_updated[column] = data_updated[column].map(replacement_string_dict).fillna(data_updated[column])
         
     return data_updated
 
+# Numbers checked by the aggregation functions one to six
+_INDICATOR_VALUES = {"one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6}
+
 # Aggregate a column given a particular aggregation function
 def aggregate_col(data, aggregation_column, column_to_be_aggregated, agg_function): 
     '''
@@ -280,39 +238,16 @@ def aggregate_col(data, aggregation_column, column_to_be_aggregated, agg_functio
     -------
         pd df
         Aggregated column with aggregation_column as index. This comes as pd df. (e.g., average weight by species)
+        The results of one to six are 0 and 1 (stored as int8). 
     '''
     
-    if agg_function == "mean": 
-        agg_function = custom_mean
-        
-    if agg_function == "median": 
-        agg_function = custom_median
-        
-    if agg_function == "max": 
-        agg_function = custom_max
-    
-    if agg_function == "min": 
-        agg_function = custom_min
-        
-    if agg_function == "one":
-        agg_function = custom_one
-        
-    if agg_function == "two":
-        agg_function = custom_two
-        
-    if agg_function == "three":
-        agg_function = custom_three
-        
-    if agg_function == "four":
-        agg_function = custom_four
-        
-    if agg_function == "five":
-        agg_function = custom_five
-        
-    if agg_function == "six":
-        agg_function = custom_six
-    
-    agg_col = pd.DataFrame(data.groupby(aggregation_column)[column_to_be_aggregated].agg(agg_function)) # (
+    if agg_function in _INDICATOR_VALUES: 
+        # 1 if the respective number is present in the group and 0 otherwise
+        indicator = (data[column_to_be_aggregated] == _INDICATOR_VALUES[agg_function]).astype("int8")
+        agg_col = pd.DataFrame(indicator.groupby(data[aggregation_column]).max())
+    else: 
+        # mean, median, max, and min are passed as strings so pandas uses its built-in aggregations
+        agg_col = pd.DataFrame(data.groupby(aggregation_column)[column_to_be_aggregated].agg(agg_function))
 
     return agg_col
 
@@ -340,48 +275,62 @@ def aggregate_data(data, aggregation_information, aggregation_variable):
     -------
         pd df
         A dataset containing all the variables specified in the aggregation_information aggregated according
-        to the instructions in the respective dataset. 
+        to the instructions in the respective dataset. Dummies and the results of one to six are 0 and 1 
+        (stored as int8). 
     '''
     
-    # Replace aggregation_variable with aggregation string
-    dat = data.copy()
-    
-    # Rename the aggregation_information file
-    aggregation_information.columns = ["variable", "agg_function"]
+    # Rename the aggregation_information columns (without changing the aggregation_information passed in)
+    aggregation_information = aggregation_information.set_axis(["variable", "agg_function"], axis = 1)
     
     # Check if any dummies are requested
     dummies = list(aggregation_information.loc[aggregation_information["agg_function"] == "dummy", "variable"])
     
     if len(dummies) > 0: 
-        # Generate the dummies and add them to the data
-        dat_dummies = pd.get_dummies(dat[dummies], prefix=dummies)
-        dat = pd.concat([dat, dat_dummies], axis = 1)
+        # Generate the dummies. They are aggregated using "max" and do not need to be added to the data
+        dat_dummies = pd.get_dummies(data[dummies], prefix = dummies, dtype = "int8")
         
-        # Add new aggregation instructions for the dummies
-        dummy_instructions = pd.DataFrame([[var, "max"] for var in dat_dummies.columns], columns=["variable", "agg_function"])
-        aggregation_information = aggregation_information.append(dummy_instructions)
-            
         # Remove old aggregation instructions
         aggregation_information = aggregation_information[~aggregation_information["variable"].isin(dummies)]
     
-    # Aggregate all variables as requested
-    data_aggregated = dat[aggregation_variable].drop_duplicates()
+    variables = list(aggregation_information["variable"])
+    agg_functions = list(aggregation_information["agg_function"])
     
-    aggregation_information = aggregation_information.reset_index(drop=True)
-
-    for ind in tqdm(aggregation_information.index): 
-        aggregated_col = aggregate_col(dat, aggregation_variable, 
-                                       aggregation_information.loc[ind, "variable"], 
-                                       aggregation_information.loc[ind, "agg_function"])
-
-        data_aggregated = pd.merge(data_aggregated, aggregated_col, on = aggregation_variable)
+    # One column per instruction (numbered by position, so variables can be aggregated more than once). 
+    # Variables aggregated with one to six are replaced with indicators, so that they can be aggregated using "max"
+    columns = [(data[var] == _INDICATOR_VALUES[fn]).astype("int8") if fn in _INDICATOR_VALUES else data[var] 
+               for var, fn in zip(variables, agg_functions)]
+    agg_map = {i: "max" if fn in _INDICATOR_VALUES else fn for i, fn in enumerate(agg_functions)}
+    
+    # Nothing to aggregate: return the aggregation_variable only
+    if len(agg_map) == 0 and len(dummies) == 0: 
+        return data[[aggregation_variable]].drop_duplicates().reset_index(drop = True)
+    
+    # Group on a categorical version of the aggregation_variable, so the strings are only hashed once
+    groups = data[aggregation_variable].astype("category")
+    
+    # Aggregate all variables and the dummies as requested (groups in order of appearance)
+    data_aggregated = []
+    
+    if len(agg_map) > 0: 
+        dat = pd.concat(columns, axis = 1, keys = range(len(columns)))
+        aggregated = dat.groupby(groups, sort = False, observed = True).agg(agg_map)
+        aggregated.columns = merge_column_names(variables)
+        data_aggregated.append(aggregated)
+    
+    if len(dummies) > 0: 
+        data_aggregated.append(dat_dummies.groupby(groups, sort = False, observed = True).max())
+    
+    data_aggregated = pd.concat(data_aggregated, axis = 1).reset_index()
+    
+    # Restore the original type of the aggregation_variable
+    data_aggregated[aggregation_variable] = data_aggregated[aggregation_variable].astype(data[aggregation_variable].dtype)
         
     return data_aggregated
 
 # Function to create data that integrates all above option, namely splitting, normalization, and aggregation
 def create_data (data, split_info = None, normalization_info = None, normalization_variable = None, 
                  aggregation_category_dict = None, aggregation_category_variable = None, 
-                 aggregation_information = None, aggregation_variable = None): 
+                 aggregation_information = None, aggregation_variable = None, normalization_lookup = None): 
     '''
     Function to create an aggregated dataset containing specified variables. 
     
@@ -408,6 +357,11 @@ def create_data (data, split_info = None, normalization_info = None, normalizati
             Example 2: "Vermillion and Ghila" is replaces with two entries named 
             "Vermillion fly catcher" and "Ghila woodpecker"
         
+        normalization_lookup: pd df
+            Lookup for the normalization as created by get_lookup. Can be used instead of 
+            normalization_info to build the lookup only once when create_data is called repeatedly
+            (e.g., on parts of the same dataset). If both are given, normalization_lookup is used. 
+        
         normalization_variable: str
             The variable that needs to be normalized.
         
@@ -425,7 +379,7 @@ def create_data (data, split_info = None, normalization_info = None, normalizati
             The variable along which we want to aggregate. This is the variable as it is named
             in data. This is likley to be the same as normalization_variable (e.g., bird species). 
         
-        aggregation_category_dict: dict
+        aggregation_category_dict: dict or pd series (see repl_with_agg_string)
             Used if aggregation on a categorical variable is desired. This usually
             relates to the variable that is normalized. For example, if we have animals and plants in our variable
             and we would like to combine all the animals into "animals" and all the plants into "plants" like
@@ -444,16 +398,19 @@ def create_data (data, split_info = None, normalization_info = None, normalizati
     '''
     
     # Reset index of data (otherwise some function do not work properly)
-    dat = data.reset_index(drop=True).copy()
+    dat = data.reset_index(drop=True)
     
     # Split the variables that need splitting
     if split_info is not None: 
         dat = split_multiple_categorical_vars(dat, split_info)
     
     # Get the dictionary for normalization
-    if normalization_info is not None: 
+    if normalization_info is not None or normalization_lookup is not None: 
         
-        norm_dict = get_lookup(normalization_info)
+        if normalization_lookup is not None: 
+            norm_dict = normalization_lookup
+        else: 
+            norm_dict = get_lookup(normalization_info)
         
         # Normalize org affiliation in data
         dat = normalize_data(dat, norm_dict, normalization_variable)
@@ -462,8 +419,6 @@ def create_data (data, split_info = None, normalization_info = None, normalizati
     if aggregation_category_dict is not None:
         dat = repl_with_agg_string(dat, aggregation_category_variable, aggregation_category_dict)
     
-    dat = dat.reset_index(drop=True)
-    
     # Aggregate the data
     if aggregation_information is not None: 
         dat = aggregate_data(dat, aggregation_information, aggregation_variable)
@@ -472,91 +427,17 @@ def create_data (data, split_info = None, normalization_info = None, normalizati
 
 
 # HELPER FUNCTIONS
-# Check for nan values in object that could be anything
-# Source: https://stackoverflow.com/questions/944700/how-can-i-check-for-nan-values
-def is_nan(x):
-    return isinstance(x, float) and math.isnan(x)
-
-# Check if object is just a single number
-def response_length(x):
+# Column names of aggregated variables. Variables aggregated more than once get the suffixes _x and _y 
+# (as when merging the aggregated columns one by one)
+def merge_column_names(variables):
     
-    if isinstance(x, int): 
-        return 1
-    else:
-        return len(x)
+    names = []
     
-# Function for the mean
-def custom_mean(df):
-    return df.mean(skipna=True)
-
-# Function for the median
-def custom_median(df):
-    return df.median(skipna=True)
-
-# Function for the max
-def custom_max(df):
-    return df.max(skipna=True)
-
-# Function for the min
-def custom_min(df):
-    return df.min(skipna=True)
-
-# Function for implementation
-# Implementation is 1
-def custom_one(df):
-    '''This function is for aggregating pd df in combination with the groupby function. 
-    It takes in a grouped df and returns 1 if any of the values is 1 and 0 otherwise.'''
-    df_copy = df.copy()
-    df_copy[df_copy != 1] = 0 
-    df_copy[df_copy == 1] = 1 
-    return df_copy.max(skipna=True)
-
-# Function for implementation
-# Implementation is 2
-def custom_two(df):
-    '''This function is for aggregating pd df in combination with the groupby function. 
-    It takes in a grouped df and returns 1 if any of the values is 2 and 0 otherwise.'''
-    df_copy = df.copy()
-    df_copy[df_copy != 2] = 0 
-    df_copy[df_copy == 2] = 1 
-    return df_copy.max(skipna=True)
-
-# Function for implementation
-# Implementation is 3
-def custom_three(df):
-    '''This function is for aggregating pd df in combination with the groupby function. 
-    It takes in a grouped df and returns 1 if any of the values is 3 and 0 otherwise.'''
-    df_copy = df.copy()
-    df_copy[df_copy != 3] = 0 
-    df_copy[df_copy == 3] = 1 
-    return df_copy.max(skipna=True)
-
-# Function for implementation
-# Implementation is 4
-def custom_four(df):
-    '''This function is for aggregating pd df in combination with the groupby function. 
-    It takes in a grouped df and returns 1 if any of the values is 4 and 0 otherwise.'''
-    df_copy = df.copy()
-    df_copy[df_copy != 4] = 0 
-    df_copy[df_copy == 4] = 1 
-    return df_copy.max(skipna=True)
-
-# Function for implementation
-# Implementation is 5
-def custom_five(df):
-    '''This function is for aggregating pd df in combination with the groupby function. 
-    It takes in a grouped df and returns 1 if any of the values is 5 and 0 otherwise.'''
-    df_copy = df.copy()
-    df_copy[df_copy != 5] = 0 
-    df_copy[df_copy == 5] = 1 
-    return df_copy.max(skipna=True)
-
-# Function for implementation
-# Implementation is 6
-def custom_six(df):
-    '''This function is for aggregating pd df in combination with the groupby function. 
-    It takes in a grouped df and returns 1 if any of the values is 6 and 0 otherwise.'''
-    df_copy = df.copy()
-    df_copy[df_copy != 6] = 0 
-    df_copy[df_copy == 6] = 1 
-    return df_copy.max(skipna=True)
\ No newline at end of file
+    for var in variables: 
+        if var in names: 
+            names[names.index(var)] = str(var) + "_x"
+            names.append(str(var) + "_y")
+        else: 
+            names.append(var)
+    
+    return names
\ No newline at end of file